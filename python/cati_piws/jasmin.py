@@ -4,6 +4,9 @@ import os
 import os.path as osp
 import json
 from bz2 import BZ2File
+from uuid import uuid4
+import shutil
+import gc
 
 '''
 JASMIN stands for Json Assembly of Study Meta-Information for Neuroimaging.
@@ -65,11 +68,16 @@ class JasminFile(object):
           
         self.path = osp.normpath(osp.abspath(path))
         if dic is None :
+          # [size, mtime] of self.path when self.dict was read, None if
+          # self.dict does not come from self.path
+          self._jasmin_stat = _file_stat(self.path)
           self.dict = json.load(BZ2File(self.path))
         else :
+          self._jasmin_stat = None
           self.dict = dic
 
         self.jasmin_path = self.path + '.jasmin'
+        self._provenance = {}
 
         #print("type : ", type(self.dict))
         #print(self.dict)
@@ -167,6 +175,39 @@ class JasminFile(object):
         raise KeyError('No action with action_id={0}'.format(repr(action_id)))
     
     
+    def provenance_index(self, framework=None):
+        '''
+        Returns the ProvenanceIndex of a given framework (by default uses
+        self.framework). The index is built only once per JasminFile. If
+        self.dict was read from self.path and an index built from the same
+        version of this file has been saved next to it (see
+        save_provenance_index), it is loaded instead of being built.
+        '''
+        if framework is None:
+            framework = self.framework
+        index = self._provenance.get(framework)
+        if index is None:
+            if self._jasmin_stat is not None:
+                index = ProvenanceIndex.load_saved(self.path, framework,
+                                                   self._jasmin_stat)
+            if index is None:
+                index = ProvenanceIndex.build(self, framework)
+            self._provenance[framework] = index
+        return index
+    
+    
+    def save_provenance_index(self, framework=None):
+        '''
+        Save the ProvenanceIndex of a given framework (by default uses
+        self.framework) next to the JASMIN file, with the same permissions.
+        '''
+        if framework is None:
+            framework = self.framework
+        index = self.provenance_index(framework)
+        index.save(ProvenanceIndex.default_path(self.path, framework),
+                   jasmin_path=self.path)
+    
+    
     # Setters/Getters---------------------------
     # ------------------------------------------
     
@@ -175,9 +216,13 @@ class JasminFile(object):
     
     def set_path(self, path):
       self.path = osp.normpath(osp.abspath(path))
+      self._jasmin_stat = None
+      self._provenance = {}
       
     def set_dict(self, dic):
       self.dict = dic
+      self._jasmin_stat = None
+      self._provenance = {}
       
     @property
     def dictionary(self):
@@ -216,6 +261,8 @@ class JasminFile(object):
       
       dic = self.dict
       dic[framework]['paths'][file_path][attribute] = value
+      self._jasmin_stat = None
+      self._provenance = {}
       self.save()
       
   
@@ -266,6 +313,250 @@ class JasminFile(object):
         # TODO
         return False
         
+
+
+def _file_stat(path):
+    '''
+    Returns [size, mtime] of a file or None if it does not exist. Used to
+    detect that a JASMIN file changed since the dictionary it was indexed
+    from was read.
+    '''
+    if osp.isfile(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime]
+    return None
+
+
+class ProvenanceIndex(object):
+    '''
+    Bipartite graph between files and actions of a JASMIN framework. An
+    action consumes the files referenced in its inputs and produces the
+    files referenced in its outputs or whose path attributes contain its
+    action_id. Only parameters whose type is File or List_File are
+    considered. The index can be saved in an uncompressed JSON file next
+    to the JASMIN file (loading it is faster than building the index) with
+    the following structure:
+    
+    'framework': {framework}
+    'jasmin_stat': [{size}, {modification time}] of the JASMIN file when
+                   it was read, null if the index was built from a
+                   dictionary that was not read from the JASMIN file
+    'action_names':
+        {action_id}: {action_name}
+    'inputs':
+        {action_id}: [{path}, ...]
+    'outputs':
+        {action_id}: [{path}, ...]
+    
+    consumers ({path}: {action_ids}) and producers are the reverse of
+    inputs and outputs. They are rebuilt in memory and not saved.
+    '''
+    
+    file_types = ('File', 'List_File')
+    
+    def __init__(self, framework, dic=None, jasmin_stat=None):
+        '''
+        dic contains action_names, inputs and outputs (see load). inputs
+        and outputs must not contain duplicates. In memory, inputs,
+        outputs, consumers and producers are dictionaries of lists.
+        '''
+        self.framework = framework
+        self.jasmin_stat = jasmin_stat
+        if dic is None:
+            dic = {}
+        self.action_names = dic.get('action_names', {})
+        self.inputs = dic.get('inputs', {})
+        self.outputs = dic.get('outputs', {})
+        self.consumers = {}
+        self.producers = {}
+        for paths, actions in ((self.inputs, self.consumers),
+                               (self.outputs, self.producers)):
+            for action_id, action_paths in six.iteritems(paths):
+                for path in action_paths:
+                    path_actions = actions.get(path)
+                    if path_actions is None:
+                        actions[path] = [action_id]
+                    else:
+                        path_actions.append(action_id)
+    
+    
+    @staticmethod
+    def default_path(jasmin_path, framework):
+        '''
+        Returns the path of the index file of a framework stored next to
+        a JASMIN file.
+        '''
+        return '{0}.{1}.provenance'.format(jasmin_path, framework)
+    
+    
+    @classmethod
+    def build(cls, jasmin, framework=None):
+        '''
+        Build the index of a framework (by default uses jasmin.framework)
+        with a single scan of the actions and paths of a JasminFile.
+        '''
+        if framework is None:
+            framework = jasmin.framework
+        action_names = {}
+        xputs_paths = {'inputs': {}, 'outputs': {}}
+        for action in jasmin.iter_actions(framework=framework):
+            action_id = str(action['action_id'])
+            action_names[action_id] = action['action_name']
+            for xputs in ('inputs', 'outputs'):
+                values = action.get(xputs, {})
+                for parameter, type in six.iteritems(action.get('types', {})):
+                    if type not in cls.file_types:
+                        continue
+                    value = values.get(parameter)
+                    if not value:
+                        continue
+                    if type == 'File':
+                        value = [value]
+                    paths = xputs_paths[xputs].setdefault(action_id, set())
+                    paths.update(path for path in value if path)
+        outputs = xputs_paths['outputs']
+        for path, path_dict in jasmin.iter_paths(framework):
+            action_id = path_dict.get('action_id')
+            if action_id is not None:
+                outputs.setdefault(str(action_id), set()).add(path)
+        dic = {'action_names': action_names}
+        for xputs, paths in six.iteritems(xputs_paths):
+            dic[xputs] = dict((action_id, list(action_paths))
+                              for action_id, action_paths
+                              in six.iteritems(paths) if action_paths)
+        return cls(framework, dic, jasmin._jasmin_stat)
+    
+    
+    @classmethod
+    def load_saved(cls, jasmin_path, framework, jasmin_stat=None):
+        '''
+        Returns the index saved next to a JASMIN file if it was built from
+        the current version of this file, otherwise returns None. This
+        does not read the JASMIN file. jasmin_stat is the [size, mtime]
+        of the JASMIN file the index must correspond to (by default, the
+        current one).
+        '''
+        if jasmin_stat is None:
+            jasmin_stat = _file_stat(jasmin_path)
+            if jasmin_stat is None:
+                return None
+        index_path = cls.default_path(jasmin_path, framework)
+        if not osp.isfile(index_path):
+            return None
+        try:
+            index = cls.load(index_path)
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            # Unreadable or corrupted index
+            return None
+        if index.jasmin_stat is None or index.jasmin_stat != jasmin_stat:
+            return None
+        return index
+    
+    
+    @classmethod
+    def load(cls, path):
+        '''
+        Read an index saved with ProvenanceIndex.save.
+        '''
+        # Allocating the many lists of a large index repeatedly triggers
+        # the cyclic garbage collector, which more than doubles the
+        # loading time. No cycle is created here.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path) as f:
+                dic = json.load(f)
+            return cls(dic['framework'], dic, dic.get('jasmin_stat'))
+        finally:
+            if gc_enabled:
+                gc.enable()
+    
+    
+    def save(self, path, jasmin_path=None):
+        '''
+        Save the index. To be loaded by JasminFile.provenance_index, path
+        must be ProvenanceIndex.default_path(jasmin_path, framework).
+        The index is written in a temporary file that is renamed to path,
+        therefore readers never see a partially written index. If
+        jasmin_path is given, its permissions are copied to the index,
+        otherwise they follow the umask.
+        '''
+        dic = {'framework': self.framework,
+               'jasmin_stat': self.jasmin_stat,
+               'action_names': self.action_names,
+               'inputs': self.inputs,
+               'outputs': self.outputs}
+        tmp_path = '{0}.{1}.tmp'.format(path, uuid4().hex)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dic, f, separators=(',', ':'))
+            if jasmin_path is not None:
+                shutil.copymode(jasmin_path, tmp_path)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+    
+    
+    def consumers_of(self, path):
+        '''
+        Returns the sorted list of action_id of actions using path as input.
+        '''
+        return sorted(self.consumers.get(path, ()))
+    
+    
+    def producers_of(self, path):
+        '''
+        Returns the sorted list of action_id of actions that generated path.
+        '''
+        return sorted(self.producers.get(path, ()))
+    
+    
+    def _traverse(self, path, file_to_actions, action_to_files):
+        files = []
+        actions = []
+        seen_files = set([path])
+        seen_actions = set()
+        queue = [path]
+        while queue:
+            next_queue = []
+            for current_path in queue:
+                for action_id in sorted(file_to_actions.get(current_path, ())):
+                    if action_id in seen_actions:
+                        continue
+                    seen_actions.add(action_id)
+                    actions.append(action_id)
+                    for action_path in sorted(action_to_files.get(action_id, ())):
+                        if action_path not in seen_files:
+                            seen_files.add(action_path)
+                            files.append(action_path)
+                            next_queue.append(action_path)
+            queue = next_queue
+        return (files, actions)
+    
+    
+    def upstream(self, path):
+        '''
+        Returns the full lineage of a path as a tuple (files, actions)
+        where actions is the list of action_id of all actions that
+        contributed directly or indirectly to the generation of path and
+        files is the list of paths used by these actions. Nearest items
+        come first.
+        '''
+        return self._traverse(path, self.producers, self.inputs)
+    
+    
+    def downstream(self, path):
+        '''
+        Returns a tuple (files, actions) where actions is the list of
+        action_id of all actions that depend directly or indirectly on
+        path and files is the list of paths they generated. Nearest items
+        come first.
+        '''
+        return self._traverse(path, self.consumers, self.outputs)
+
     
 class JasminIO(object):
   '''
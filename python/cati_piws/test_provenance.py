@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import json
+import jasmin
+from bz2 import BZ2File
+import unittest
+import stat
+import time
+from tempfile import mkdtemp
+import shutil
+
+
+class TestProvenanceIndex(unittest.TestCase):
+  '''
+  Test class for the file/action provenance graph of jasmin files
+  '''
+  
+  def sorted_map(self, dic):
+    return dict((k, sorted(v)) for k, v in dic.items())
+  
+  def setUp(self):
+    '''   
+    Setting up a jasmin file with a chain of actions:
+    t1.nii -> segmentation (1) -> grey.nii, white.nii -> morphometry (2) -> stats.csv
+    '''
+    self.tmpdir = mkdtemp('','test_provenance_')
+    self.jasmin_path = os.path.join(self.tmpdir, 'study.jasmin')
+    self.framework = 'catidb_piws'
+    dic = {self.framework: {
+      'paths': {
+        't1.nii': {'action_id': 0, 'generated_by_action': 'import'},
+        'grey.nii': {'action_id': 1, 'generated_by_action': 'segmentation'},
+        'white.nii': {'action_id': 1, 'generated_by_action': 'segmentation'},
+        'stats.csv': {'action_id': 2, 'generated_by_action': 'morphometry'},
+      },
+      'actions': {
+        'segmentation': {
+          '1': {'types': {'t1': 'File', 'tissues': 'List_File',
+                          'threshold': 'Float'},
+                'inputs': {'t1': 't1.nii', 'threshold': 0.5},
+                'outputs': {'tissues': ['grey.nii', 'white.nii']}},
+        },
+        'morphometry': {
+          '2': {'types': {'grey': 'File', 'white': 'File', 'stats': 'File',
+                          'mask': 'File'},
+                'inputs': {'grey': 'grey.nii', 'white': 'white.nii',
+                           'mask': None},
+                'outputs': {'stats': 'stats.csv'}},
+        },
+      }}}
+    json.dump(dic, BZ2File(self.jasmin_path, 'w'))
+    
+  def tearDown(self):
+    '''   
+    Clean-up of temporary directory
+    '''
+    shutil.rmtree(self.tmpdir)
+    
+  def test_Queries(self):
+    '''   
+    Testing direct and transitive queries
+    '''
+    j_file = jasmin.JasminFile(self.jasmin_path)
+    index = j_file.provenance_index(self.framework)
+    self.assertTrue(index is j_file.provenance_index(self.framework))
+    
+    self.assertEqual(index.consumers_of('t1.nii'), ['1'])
+    self.assertEqual(index.producers_of('t1.nii'), ['0'])
+    self.assertEqual(index.producers_of('stats.csv'), ['2'])
+    self.assertEqual(index.consumers_of('stats.csv'), [])
+    
+    files, actions = index.upstream('stats.csv')
+    self.assertEqual(actions, ['2', '1', '0'])
+    self.assertEqual(sorted(files), ['grey.nii', 't1.nii', 'white.nii'])
+    
+    files, actions = index.downstream('t1.nii')
+    self.assertEqual(actions, ['1', '2'])
+    self.assertEqual(sorted(files), ['grey.nii', 'stats.csv', 'white.nii'])
+    
+  def test_SaveLoad(self):
+    '''   
+    Testing persistence of the index next to the jasmin file
+    '''
+    j_file = jasmin.JasminFile(self.jasmin_path)
+    index = j_file.provenance_index(self.framework)
+    index_path = jasmin.ProvenanceIndex.default_path(self.jasmin_path,
+                                                     self.framework)
+    j_file.save_provenance_index(self.framework)
+    
+    loaded = jasmin.JasminFile(self.jasmin_path).provenance_index(
+      self.framework)
+    self.assertEqual(loaded.upstream('stats.csv'), index.upstream('stats.csv'))
+    self.assertEqual(self.sorted_map(loaded.producers),
+                     self.sorted_map(index.producers))
+    
+#    The saved index can be loaded without reading the jasmin file
+    saved = jasmin.ProvenanceIndex.load_saved(self.jasmin_path,
+                                              self.framework)
+    self.assertEqual(saved.upstream('stats.csv'), index.upstream('stats.csv'))
+    
+#    The index has the permissions of the jasmin file
+    for mode in (0o644, 0o640):
+      os.chmod(self.jasmin_path, mode)
+      j_file.save_provenance_index(self.framework)
+      self.assertEqual(stat.S_IMODE(os.stat(index_path).st_mode), mode)
+    self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                     sorted([os.path.basename(self.jasmin_path),
+                             os.path.basename(index_path)]))
+    
+#    An index older than the jasmin file is rebuilt
+    stale = jasmin.ProvenanceIndex(self.framework, jasmin_stat=[0, 0])
+    stale.save(index_path)
+    rebuilt = jasmin.JasminFile(self.jasmin_path).provenance_index(
+      self.framework)
+    self.assertEqual(rebuilt.consumers_of('t1.nii'), ['1'])
+    
+#    A corrupted index is rebuilt
+    with open(index_path, 'wb') as f:
+      f.write(b'BZh91AY&SY')
+    rebuilt = jasmin.JasminFile(self.jasmin_path).provenance_index(
+      self.framework)
+    self.assertEqual(rebuilt.consumers_of('t1.nii'), ['1'])
+    
+#    The index saved on disk is ignored for a dictionary given in memory
+    index.save(index_path)
+    dic = {self.framework: {'paths': {'other.nii': {'action_id': 3}},
+                            'actions': {}}}
+    j_memory = jasmin.JasminFile(self.jasmin_path, dic)
+    in_memory = j_memory.provenance_index(self.framework)
+    self.assertEqual(in_memory.producers_of('other.nii'), ['3'])
+    self.assertEqual(in_memory.consumers_of('t1.nii'), [])
+    
+#    An index built from a dictionary given in memory is never loaded
+#    for the jasmin file
+    j_memory.save_provenance_index(self.framework)
+    loaded = jasmin.JasminFile(self.jasmin_path).provenance_index(
+      self.framework)
+    self.assertEqual(loaded.producers_of('t1.nii'), ['0'])
+    self.assertEqual(loaded.producers_of('other.nii'), [])
+    
+  def test_LoadFasterThanBuild(self):
+    '''   
+    Testing that loading a saved index is faster than building it
+    '''
+    actions = {}
+    paths = {}
+    for i in range(20000):
+      output = 'subject%d/output%d.nii' % (i % 100, i)
+      actions[str(i)] = {'types': {'input': 'File', 'output': 'File'},
+                         'inputs': {'input': 'subject%d/t1.nii' % (i % 100)},
+                         'outputs': {'output': output}}
+      paths[output] = {'action_id': i}
+    json.dump({self.framework: {'paths': paths,
+                                'actions': {'segmentation': actions}}},
+              BZ2File(self.jasmin_path, 'w'))
+    j_file = jasmin.JasminFile(self.jasmin_path)
+    j_file.save_provenance_index(self.framework)
+    build_time = load_time = None
+    for i in range(3):
+      start = time.time()
+      index = jasmin.ProvenanceIndex.build(j_file, self.framework)
+      duration = time.time() - start
+      build_time = min(duration, build_time or duration)
+      start = time.time()
+      loaded = jasmin.ProvenanceIndex.load_saved(self.jasmin_path,
+                                                 self.framework)
+      duration = time.time() - start
+      load_time = min(duration, load_time or duration)
+    for name in ('inputs', 'outputs', 'consumers', 'producers'):
+      self.assertEqual(self.sorted_map(getattr(loaded, name)),
+                       self.sorted_map(getattr(index, name)))
+    self.assertTrue(load_time < build_time,
+                    'load: %.3f s, build: %.3f s' % (load_time, build_time))
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestProvenanceIndex)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+    
+if __name__ == '__main__':
+    print("RETURNCODE: ", test())
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import verify
+import unittest
+from tempfile import mkdtemp
+import shutil
+
+
+class TestVerify(unittest.TestCase):
+  '''
+  Test class for verification of exported files
+  '''
+  
+  def write(self, path, content):
+    with open(path, 'wb') as f:
+      f.write(content)
+  
+  def setUp(self):
+    '''   
+    Setting up a source directory and an export directory made of hard links
+    '''
+    self.tmpdir = mkdtemp('','test_verify_')
+    self.source_dir = os.path.join(self.tmpdir, 'source')
+    self.export_dir = os.path.join(self.tmpdir, 'export')
+    os.makedirs(os.path.join(self.source_dir, 'directory'))
+    os.makedirs(self.export_dir)
+    
+    self.source_file = os.path.join(self.source_dir, 'image.nii')
+    self.write(self.source_file, b'0123456789')
+    self.write(os.path.join(self.source_dir, 'directory', 'a.txt'), b'abc')
+    self.write(os.path.join(self.source_dir, 'directory', 'b.txt'), b'defgh')
+    
+    self.linked_file = os.path.join(self.export_dir, 'linked.nii')
+    os.link(self.source_file, self.linked_file)
+    self.copied_file = os.path.join(self.export_dir, 'copied.nii')
+    self.write(self.copied_file, b'0123456788')
+    self.linked_dir = os.path.join(self.export_dir, 'directory')
+    os.makedirs(self.linked_dir)
+    for filename in ('a.txt', 'b.txt'):
+      os.link(os.path.join(self.source_dir, 'directory', filename),
+              os.path.join(self.linked_dir, filename))
+    
+  def tearDown(self):
+    '''   
+    Clean-up of temporary directory
+    '''
+    shutil.rmtree(self.tmpdir)
+    
+  def test_VerifyPath(self):
+    '''   
+    Testing verification of a single exported path
+    '''
+#    Correct hard link with checksum
+    problems, size, read, digests = verify.verify_path(self.linked_file, 10,
+                                              self.source_file,
+                                              checksum='md5')
+    self.assertEqual(problems, [])
+    self.assertEqual(size, 10)
+    self.assertEqual(read, 10)
+    self.assertEqual(list(digests.keys()), [self.linked_file])
+    
+#    Size mismatch
+    problems, size, read, digests = verify.verify_path(self.linked_file, 11)
+    self.assertEqual(len(problems), 1)
+    
+#    Copy instead of hard link, with different content
+    problems, size, read, digests = verify.verify_path(self.copied_file, 10,
+                                              self.source_file,
+                                              checksum='md5')
+    self.assertEqual(len(problems), 2)
+    
+#    Without source, only the number of links can be checked
+    self.assertEqual(verify.verify_path(self.linked_file, linked=True)[0], [])
+    self.assertEqual(len(verify.verify_path(self.copied_file,
+                                            linked=True)[0]), 1)
+    
+#    Directory exported with "cp -al"
+    problems, size, read, digests = verify.verify_path(
+      self.linked_dir, 8, os.path.join(self.source_dir, 'directory'))
+    self.assertEqual(problems, [])
+    self.assertEqual(size, 8)
+    
+#    Directory partially exported
+    os.remove(os.path.join(self.linked_dir, 'b.txt'))
+    problems, size, read, digests = verify.verify_path(
+      self.linked_dir, None, os.path.join(self.source_dir, 'directory'))
+    self.assertEqual(problems, ['missing file: %s'
+                                % os.path.join(self.linked_dir, 'b.txt')])
+    self.assertEqual(size, 3)
+    
+#    Missing file
+    problems, size, read, digests = verify.verify_path(
+      os.path.join(self.export_dir, 'missing.nii'), 10)
+    self.assertEqual(len(problems), 1)
+    
+  def test_VerifyFiles(self):
+    '''   
+    Testing concurrent verification and report
+    '''
+    files = [(self.linked_file, self.source_file, 10),
+             (self.copied_file, self.source_file, 10),
+             (self.linked_dir, os.path.join(self.source_dir, 'directory'), 8)]
+    report = verify.VerifyReport()
+    for result in verify.verify_files(files, jobs=2, checksum='md5'):
+      report.add(*result)
+    report.finish()
+    self.assertEqual(report.count, 3)
+    self.assertEqual(report.size, 28)
+    self.assertEqual(list(report.mismatches.keys()), [self.copied_file])
+    self.assertEqual(sorted(report.digests.keys()),
+                     sorted([self.linked_file,
+                             os.path.join(self.linked_dir, 'a.txt'),
+                             os.path.join(self.linked_dir, 'b.txt')]))
+    
+  def test_Manifest(self):
+    '''   
+    Testing checksum verification against a manifest
+    '''
+    files = [(self.linked_file, None, 10), (self.linked_dir, None, 8)]
+    report = verify.run_verification(files, 2, jobs=2, checksum='md5')
+    manifest = os.path.join(self.tmpdir, 'study.jasmin.md5')
+    verify.write_manifest(manifest, report.digests, self.export_dir)
+    checksums = verify.read_manifest(manifest, self.export_dir)
+    self.assertEqual(len(checksums), 3)
+    
+    report = verify.run_verification(files, 2, checksum='md5',
+                                     checksums=checksums)
+    self.assertEqual(report.mismatches, {})
+    
+#    Modified content and file missing from the manifest
+    self.write(self.linked_file, b'9876543210')
+    files.append((self.copied_file, None, 10))
+    report = verify.run_verification(files, 3, checksum='md5',
+                                     checksums=checksums)
+    self.assertEqual(sorted(report.mismatches.keys()),
+                     sorted([self.linked_file, self.copied_file]))
+    
+  def test_InvalidParameters(self):
+    '''   
+    Testing that invalid parameters are rejected before verification
+    '''
+    files = [(self.linked_file, None, 10)]
+    self.assertRaises(ValueError, list,
+                      verify.verify_files(files, checksum='nosuch'))
+    self.assertRaises(ValueError, list, verify.verify_files(files, jobs=0))
+
+
+def test():
+    """ Function to execute unitest
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestVerify)
+    runtime = unittest.TextTestRunner(verbosity=2).run(suite)
+    return runtime.wasSuccessful()
+    
+if __name__ == '__main__':
+    print("RETURNCODE: ", test())
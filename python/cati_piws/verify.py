@@ -0,0 +1,331 @@
+from __future__ import print_function
+from __future__ import division
+import sys
+import os
+import os.path as osp
+import stat
+import errno
+import time
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+'''
+Verification of files exported with a JASMIN file. Each exported file is
+checked for existence, hard-link identity with its source, size and,
+optionally, checksum. Files are checked concurrently from a pool of threads
+so that the verification of a large study is bounded by the storage speed
+rather than by the latency of individual stat calls.
+
+Checksums computed at export time are written in a manifest next to the
+JASMIN file ({jasmin_file}.{algorithm}). The manifest has the format of
+md5sum and related tools: one "{digest}  {path}" line per file, path being
+relative to the directory containing the JASMIN file. It is the reference
+used to verify checksums of an existing export.
+'''
+
+default_jobs = 16
+default_block_size = 1024 * 1024
+
+# Algorithms usable with --checksum. Variable length digests (shake_*) are
+# excluded because their hexdigest requires a length.
+checksum_algorithms = sorted(a for a in hashlib.algorithms_available
+                             if not a.lower().startswith('shake_'))
+
+
+def sizeof_fmt(num, suffix='B'):
+    for unit in ['','Ki','Mi','Gi','Ti','Pi','Ei','Zi']:
+        if abs(num) < 1024.0:
+            return "%3.2f %s%s" % (num, unit, suffix)
+        num /= 1024.0
+    return "%.2f %s%s" % (num, 'Yi', suffix)
+
+
+def file_checksum(path, algorithm='md5', block_size=default_block_size):
+    '''
+    Returns the hexadecimal digest of the content of a file. The file is
+    read by blocks of block_size bytes to avoid loading it in memory.
+    '''
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(jasmin_path, algorithm):
+    '''
+    Returns the default path of the checksum manifest of a JASMIN file.
+    '''
+    return '{0}.{1}'.format(jasmin_path, algorithm)
+
+
+def write_manifest(path, digests, root):
+    '''
+    Write a checksum manifest. digests is a dictionary {file: digest}
+    where files are located in root directory.
+    '''
+    with open(path, 'w') as f:
+        for file_path in sorted(digests):
+            f.write('%s  %s\n' % (digests[file_path],
+                                  osp.relpath(file_path, root)))
+
+
+def read_manifest(path, root):
+    '''
+    Read a checksum manifest and returns a dictionary {file: digest}
+    where files are normalized paths joined to root directory.
+    '''
+    digests = {}
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            digest, file_path = line.split('  ', 1)
+            digests[osp.normpath(osp.join(root, file_path))] = digest
+    return digests
+
+
+def _iter_files(dest_path, source_path):
+    '''
+    Yields (dest_file, source_file) for all regular files composing
+    dest_path. If dest_path is a file, yields only one item. If it is a
+    directory (exported with "cp -al"), yields all files it contains.
+    source_file is None if source_path is None. If source_path is a
+    directory, all files it contains are also yielded, even if they are
+    missing in dest_path.
+    '''
+    if not osp.isdir(dest_path):
+        yield (dest_path, source_path)
+        return
+    source_files = set()
+    if source_path is not None and osp.isdir(source_path):
+        for dirpath, dirnames, filenames in os.walk(source_path):
+            relative = osp.relpath(dirpath, source_path)
+            for filename in filenames:
+                source_file = osp.normpath(osp.join(relative, filename))
+                source_files.add(source_file)
+                yield (osp.normpath(osp.join(dest_path, source_file)),
+                       osp.join(dirpath, filename))
+    for dirpath, dirnames, filenames in os.walk(dest_path):
+        relative = osp.relpath(dirpath, dest_path)
+        for filename in filenames:
+            dest_file = osp.normpath(osp.join(relative, filename))
+            if dest_file in source_files:
+                continue
+            if source_path is None:
+                source_file = None
+            else:
+                source_file = osp.join(source_path, dest_file)
+            yield (osp.join(dirpath, filename), source_file)
+
+
+def verify_path(dest_path, size=None, source_path=None, linked=False,
+                checksum=None, checksums=None):
+    '''
+    Checks an exported path and returns a tuple (problems, size, read,
+    digests) where problems is a list of error messages (empty if the path
+    is correct), size is the cumulated size of the files composing the
+    path, read is the number of bytes read to compute checksums and
+    digests is a dictionary {file: digest} of computed checksums.
+
+    size: expected size in bytes (e.g. path_dict['size']). For a directory,
+        this is compared to the cumulated size of the files it contains.
+    source_path: if given, each exported file must be a hard link to the
+        corresponding source file.
+    linked: if True and source_path is not given, each exported file must
+        have more than one hard link.
+    checksum: name of a hashlib algorithm (e.g. 'md5'). If given, the
+        content of each exported file is read and its digest is compared
+        to a reference: the one in checksums if this dictionary is given
+        (see read_manifest), otherwise the one of the source file when the
+        exported file is not a hard link to it (a hard link shares its
+        content with the source).
+    '''
+    problems = []
+    total_size = 0
+    read = 0
+    digests = {}
+    try:
+        os.stat(dest_path)
+    except OSError as e:
+        return (['missing file: %s' % e.strerror], 0, 0, {})
+    for dest_file, source_file in _iter_files(dest_path, source_path):
+        try:
+            dest_stat = os.stat(dest_file)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                problems.append('missing file: %s' % dest_file)
+            else:
+                problems.append('cannot stat %s: %s' % (dest_file,
+                                                        e.strerror))
+            continue
+        if not stat.S_ISREG(dest_stat.st_mode):
+            continue
+        total_size += dest_stat.st_size
+        same_file = False
+        if source_file is not None:
+            try:
+                source_stat = os.stat(source_file)
+            except OSError as e:
+                problems.append('cannot stat source %s: %s' % (source_file,
+                                                               e.strerror))
+                source_file = None
+            else:
+                same_file = (dest_stat.st_ino == source_stat.st_ino and
+                             dest_stat.st_dev == source_stat.st_dev)
+                if not same_file:
+                    problems.append('not a hard link to %s' % source_file)
+        elif linked and dest_stat.st_nlink < 2:
+            problems.append('not a hard link: %s' % dest_file)
+        if checksum:
+            try:
+                dest_digest = file_checksum(dest_file, checksum)
+                read += dest_stat.st_size
+                digests[dest_file] = dest_digest
+                if checksums is not None:
+                    reference = checksums.get(osp.normpath(dest_file))
+                    if reference is None:
+                        problems.append('no reference %s checksum for %s' %
+                                        (checksum, dest_file))
+                    elif dest_digest != reference:
+                        problems.append('%s checksum mismatch for %s' %
+                                        (checksum, dest_file))
+                elif source_file is not None and not same_file:
+                    source_digest = file_checksum(source_file, checksum)
+                    read += source_stat.st_size
+                    if dest_digest != source_digest:
+                        problems.append('%s checksum mismatch with %s' %
+                                        (checksum, source_file))
+            except (IOError, OSError) as e:
+                problems.append('cannot read %s: %s' % (e.filename,
+                                                        e.strerror))
+    if size is not None and total_size != size:
+        problems.append('size mismatch: expected %d bytes, found %d' %
+                        (size, total_size))
+    return (problems, total_size, read, digests)
+
+
+def _verify_item(args):
+    dest_path, kwargs = args
+    return (dest_path,) + verify_path(dest_path, **kwargs)
+
+
+def verify_files(files, jobs=default_jobs, linked=False, checksum=None,
+                 checksums=None):
+    '''
+    Checks exported paths concurrently with a pool of jobs threads.
+    files is an iterable of (dest_path, source_path, size) where
+    source_path and size may be None (see verify_path). Yields
+    (dest_path, problems, size, read, digests) in completion order.
+    Raises ValueError if jobs or checksum are invalid.
+    '''
+    if jobs < 1:
+        raise ValueError('Number of jobs must be at least 1, not %d' % jobs)
+    if checksum and checksum not in checksum_algorithms:
+        raise ValueError('Unsupported checksum algorithm: %s' % checksum)
+    items = ((dest_path, dict(size=size,
+                              source_path=source_path,
+                              linked=linked,
+                              checksum=checksum,
+                              checksums=checksums))
+             for dest_path, source_path, size in files)
+    pool = ThreadPool(jobs)
+    try:
+        for result in pool.imap_unordered(_verify_item, items, chunksize=16):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_verification(files, total, jobs=default_jobs, linked=False,
+                     checksum=None, checksums=None, verbose=False,
+                     log=sys.stderr):
+    '''
+    Checks exported paths with verify_files and returns a finished
+    VerifyReport. Problems are printed on log as they are found. If
+    verbose is True, progress is also printed every 1000 paths. total is
+    the number of paths in files, only used for progress messages.
+    '''
+    if verbose:
+        print('Verifying', total, 'files with', jobs, 'threads', file=log)
+    report = VerifyReport()
+    for dest_path, problems, size, read, digests in verify_files(
+            files, jobs=jobs, linked=linked, checksum=checksum,
+            checksums=checksums):
+        report.add(dest_path, problems, size, read, digests)
+        for problem in problems:
+            print('ERROR: %s: %s' % (dest_path, problem), file=log)
+        if verbose:
+            if report.count % 1000 == 0:
+                print('{0} files verified on {1} ({2} mismatches)'.format(
+                    report.count, total, len(report.mismatches)), file=log)
+    report.finish()
+    return report
+
+
+class VerifyReport(object):
+    '''
+    Accumulates results yielded by verify_files and computes a summary
+    of the verification (mismatches and throughput). Digests of paths
+    without problems are kept in self.digests to write a manifest.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+        self.read = 0
+        self.mismatches = {}
+        self.digests = {}
+        self.start_time = time.time()
+        self.end_time = None
+
+    def add(self, dest_path, problems, size, read, digests=None):
+        self.count += 1
+        self.size += size
+        self.read += read
+        if problems:
+            self.mismatches[dest_path] = problems
+        elif digests:
+            self.digests.update(digests)
+
+    def finish(self):
+        self.end_time = time.time()
+
+    @property
+    def duration(self):
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.time()
+        return end_time - self.start_time
+
+    @property
+    def files_per_second(self):
+        duration = self.duration
+        if duration > 0:
+            return self.count / duration
+        return 0.0
+
+    @property
+    def bytes_per_second(self):
+        '''
+        Read throughput when checksums are computed, otherwise the rate at
+        which exported data size was checked.
+        '''
+        duration = self.duration
+        if duration > 0:
+            return (self.read or self.size) / duration
+        return 0.0
+
+    def summary(self):
+        '''
+        Returns a text summary of the verification.
+        '''
+        return '\n'.join([
+            '%d files verified in %.1f s' % (self.count, self.duration),
+            '%d files with mismatches' % len(self.mismatches),
+            'Throughput: %.1f files/s, %s/s' % (
+                self.files_per_second, sizeof_fmt(self.bytes_per_second))])
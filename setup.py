@@ -3,7 +3,7 @@ from setuptools import find_packages, setup
 
 # Select appropriate modules
 modules = find_packages('python')
-scripts = ['bin/catidb_export']
+scripts = ['bin/catidb_export', 'bin/catidb_verify']
 pkgdata = {
 }
 release_info = {}